@@ -1,14 +1,189 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os, sys, time, threading
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from .profiling import instrument_engine
 
-MYSQL_URL = (
-    f"mysql+pymysql://{os.environ['MYSQL_USER']}:{os.environ['MYSQL_PASSWORD']}"
-    f"@{os.environ['MYSQL_HOST']}:{os.environ.get('MYSQL_PORT','3306')}/{os.environ['MYSQL_DB']}?charset=utf8mb4"
-)
+# Workers del servidor (uvicorn --workers lee la misma variable)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Conexiones totales que el servicio puede abrir contra MySQL, repartidas entre workers.
+# Con 1 worker equivale al pool_size=5, max_overflow=10 de antes.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "15"))
+# Igual que el anterior pero para cada réplica (cada una es otro servidor con su propio límite)
+DB_REPLICA_MAX_CONNECTIONS = int(os.getenv("DB_REPLICA_MAX_CONNECTIONS", str(DB_MAX_CONNECTIONS)))
+# Réplicas de lectura (URLs SQLAlchemy separadas por coma). Vacío = todo va al primario.
+MYSQL_REPLICA_URLS = [u.strip() for u in os.getenv("MYSQL_REPLICA_URLS", "").split(",") if u.strip()]
+# Cada cuánto se re-verifica una réplica (sana o caída) con SELECT 1
+REPLICA_CHECK_SEC = float(os.getenv("MYSQL_REPLICA_CHECK_SEC", "5"))
 
-engine = create_engine(MYSQL_URL, pool_pre_ping=True, pool_size=5, max_overflow=10, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+def mysql_url() -> str:
+    return (
+        f"mysql+pymysql://{os.environ['MYSQL_USER']}:{os.environ['MYSQL_PASSWORD']}"
+        f"@{os.environ['MYSQL_HOST']}:{os.environ.get('MYSQL_PORT','3306')}/{os.environ['MYSQL_DB']}?charset=utf8mb4"
+    )
+
+def pool_sizes(workers: int = WEB_CONCURRENCY, total: int = DB_MAX_CONNECTIONS) -> tuple[int, int]:
+    """(pool_size, max_overflow) por worker; mantiene la proporción 1:2 de la config original."""
+    per_worker = total // max(1, workers)
+    if per_worker < 2:
+        # Cada worker necesita al menos 2 conexiones; repartir menos superaría el total pedido
+        raise ValueError(
+            f"{total} conexiones no alcanzan para {workers} workers (mínimo 2 por worker): "
+            f"sube DB_MAX_CONNECTIONS/DB_REPLICA_MAX_CONNECTIONS o baja WEB_CONCURRENCY"
+        )
+    pool_size = max(1, per_worker // 3)
+    return pool_size, per_worker - pool_size
+
+def check_pool_budget() -> None:
+    """Valida al arrancar el reparto de conexiones del primario y de las réplicas (ValueError si no alcanza)."""
+    pool_sizes()
+    if MYSQL_REPLICA_URLS:
+        pool_sizes(total=DB_REPLICA_MAX_CONNECTIONS)
+
+# El engine se crea en el proceso que lo usa (después del fork del worker), nunca al importar.
+_engine = None
+_engine_pid = None
+_session_factory = None
+
+def get_engine():
+    global _engine, _engine_pid, _session_factory
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        if _engine is not None:
+            # Engine heredado del proceso padre: soltamos el pool sin cerrar sus sockets
+            _engine.dispose(close=False)
+        pool_size, max_overflow = pool_sizes()
+        _engine = create_engine(mysql_url(), pool_pre_ping=True, pool_size=pool_size,
+                                max_overflow=max_overflow, future=True)
+        instrument_engine(_engine)
+        _session_factory = sessionmaker(bind=_engine, autoflush=False, autocommit=False, future=True)
+        _engine_pid = pid
+    return _engine
+
+def SessionLocal():
+    get_engine()
+    return _session_factory()
+
+# ====== Réplicas de lectura ======
+# El health check (SELECT 1, hasta connect_timeout=2 s) corre en un hilo aparte; el camino
+# del request sólo lee el estado cacheado y nunca bloquea el event loop esperando a una réplica.
+# Una réplica recién configurada no recibe lecturas hasta que su primer chequeo sale bien.
+_replicas: dict = {}          # url -> (pid, engine, session_factory)
+_replica_health: dict = {}    # url -> (sana, time.monotonic() del último chequeo)
+_replica_checking: set = set()
+_replica_lock = threading.Lock()
+_replica_rr = 0
+
+class _ReplicaSession(Session):
+    """Sesión sobre una réplica: si la réplica falla a mitad de la llamada, la marca caída y
+    repite la lectura en el primario."""
+    replica_url: str = ""
+    _fallback = None
+
+    def execute(self, *args, **kwargs):
+        if self._fallback is not None:
+            return self._fallback.execute(*args, **kwargs)
+        try:
+            return super().execute(*args, **kwargs)
+        except OperationalError as e:
+            _mark_replica(self.replica_url, False, e)
+            try:
+                super().rollback()
+            except Exception:
+                pass
+            self._fallback = SessionLocal()
+            return self._fallback.execute(*args, **kwargs)
+
+    def close(self):
+        if self._fallback is not None:
+            self._fallback.close()
+            self._fallback = None
+        super().close()
+
+def _replica(url: str):
+    pid = os.getpid()
+    entry = _replicas.get(url)
+    if entry is not None and entry[0] == pid:
+        return entry
+    # El hilo de health check y el request pueden llegar a la vez: un solo engine por réplica
+    with _replica_lock:
+        entry = _replicas.get(url)
+        if entry is None or entry[0] != pid:
+            if entry is not None:
+                entry[1].dispose(close=False)
+            pool_size, max_overflow = pool_sizes(total=DB_REPLICA_MAX_CONNECTIONS)
+            eng = create_engine(url, pool_pre_ping=True, pool_size=pool_size, max_overflow=max_overflow,
+                                connect_args={"connect_timeout": 2}, future=True)
+            instrument_engine(eng)
+            factory = sessionmaker(bind=eng, class_=_ReplicaSession, autoflush=False, autocommit=False,
+                                   future=True)
+            entry = _replicas[url] = (pid, eng, factory)
+    return entry
+
+def _mark_replica(url: str, healthy: bool, error=None) -> None:
+    if not healthy and _replica_health.get(url, (True,))[0]:
+        print(f"[db] réplica no disponible ({make_url(url)}): {error}", file=sys.stderr, flush=True)
+    _replica_health[url] = (healthy, time.monotonic())
+
+def _check_replica(url: str) -> None:
+    try:
+        with _replica(url)[1].connect() as conn:
+            conn.execute(text("SELECT 1"))
+        _mark_replica(url, True)
+    except Exception as e:
+        _mark_replica(url, False, e)
+    finally:
+        with _replica_lock:
+            _replica_checking.discard(url)
+
+def _replica_healthy(url: str) -> bool:
+    # Réplica sin chequear todavía no se usa (va al primario): el primer connect puede tardar
+    # connect_timeout y no debe pasar en el camino del request
+    healthy, checked = _replica_health.get(url, (False, float("-inf")))
+    if time.monotonic() - checked >= REPLICA_CHECK_SEC:
+        with _replica_lock:
+            start = url not in _replica_checking
+            _replica_checking.add(url)
+        if start:
+            threading.Thread(target=_check_replica, args=(url,), name="replica-check", daemon=True).start()
+    return healthy
+
+def start_replica_checks() -> None:
+    """Lanza el primer health check de cada réplica (al arrancar el worker)."""
+    for url in MYSQL_REPLICA_URLS:
+        _replica_healthy(url)
+
+def ReadSessionLocal():
+    """Sesión de sólo lectura: réplica sana en round-robin, o el primario si no hay ninguna."""
+    global _replica_rr
+    n = len(MYSQL_REPLICA_URLS)
+    for i in range(n):
+        idx = (_replica_rr + i) % n
+        url = MYSQL_REPLICA_URLS[idx]
+        if _replica_healthy(url):
+            _replica_rr = (idx + 1) % n
+            sess = _replica(url)[2]()
+            sess.replica_url = url
+            return sess
+    return SessionLocal()
+
+def dispose_engine() -> None:
+    global _engine, _engine_pid, _session_factory
+    if _engine is not None and _engine_pid == os.getpid():
+        _engine.dispose()
+    _engine = _engine_pid = _session_factory = None
+    for url, (pid, eng, _) in list(_replicas.items()):
+        if pid == os.getpid():
+            eng.dispose()
+    _replicas.clear()
+    _replica_health.clear()
+    _replica_checking.clear()
+
+def __getattr__(name):
+    # compat: `from .db import engine`
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
 
 def get_session():
     db = SessionLocal()
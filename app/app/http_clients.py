@@ -0,0 +1,32 @@
+# app/app/http_clients.py
+"""
+Cliente HTTP compartido por proceso (Ollama y sinks).
+
+Se crea perezosamente en el worker que lo usa, así no se hereda un pool de
+conexiones a través del fork y se reutilizan conexiones keep-alive entre llamadas.
+"""
+import os
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+
+_client = None
+_client_pid = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+        _client_pid = pid
+    return _client
+
+async def close_http_client() -> None:
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        await _client.aclose()
+    _client = _client_pid = None
@@ -1,10 +1,18 @@
 
 import os, httpx, hashlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
 
 
 # from .models import OdooInvoice, ZohoSalesOrder  # se usan en los mocks (lo dejamos)
 from .models import OdooInvoice, ZohoSalesOrder
 from .mcp_server import mcp as mcp_router
+from .db import get_engine, dispose_engine, check_pool_budget, start_replica_checks
+from .redis_kv import close_redis
+from .http_clients import close_http_client
+from .preanalyze import preanalyzer
+from .schemas import compile_validators
+from .profiling import flush_profiles
 
 SINK_ODOO_URL = os.getenv("SINK_ODOO_URL", "http://127.0.0.1:8080/mock/odoo/invoices")
 SINK_ZOHO_URL = os.getenv("SINK_ZOHO_URL", "http://127.0.0.1:8080/mock/zoho/salesorders")
@@ -23,7 +31,22 @@ BASE_ANALYZE_PROMPT = os.getenv(
      "(3) alertas de riesgo (voided, estado de pago/envío), (4) sugerencia de acción.")
 )
 
-app = FastAPI(title="MCP Orchestrator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Corre en cada worker después del fork: los recursos se crean aquí, no al importar
+    check_pool_budget()
+    get_engine()
+    start_replica_checks()
+    compile_validators()
+    yield
+    # uvicorn (--timeout-graceful-shutdown SHUTDOWN_DRAIN_SEC) ya esperó las requests en curso
+    await flush_profiles()
+    await preanalyzer.stop()
+    await close_http_client()
+    await close_redis()
+    dispose_engine()
+
+app = FastAPI(title="MCP Orchestrator", lifespan=lifespan)
 
 app.include_router(mcp_router)
 
@@ -0,0 +1,132 @@
+# app/app/preanalyze.py
+"""
+Pre-análisis especulativo de órdenes recién pagadas (opt-in, PREANALYZE_ENABLED=1).
+
+webhooks.order_paid encola la orden; un worker en background arma el mismo prompt
+que orders.analyze y lo corre en Ollama cuando el modelo lleva PREANALYZE_IDLE_SEC sin
+llamadas en vivo de ningún worker (la actividad se comparte en Redis, ver tools.py).
+El resultado queda en Redis con una huella del prompt+modelo: si la orden no cambió,
+orders.analyze lo devuelve sin esperar al LLM.
+"""
+import os, sys, time, asyncio, hashlib, contextvars
+from typing import Optional
+
+PREANALYZE_ENABLED = os.getenv("PREANALYZE_ENABLED", "0") == "1"
+PREANALYZE_IDLE_SEC = float(os.getenv("PREANALYZE_IDLE_SEC", "2"))
+PREANALYZE_MAX_BACKLOG = int(os.getenv("PREANALYZE_MAX_BACKLOG", "100"))
+ANALYSIS_CACHE_TTL_SEC = int(os.getenv("ANALYSIS_CACHE_TTL_SEC", "86400"))
+CACHE_PREFIX = "mcp:analysis"
+
+
+def analysis_fingerprint(prompt: str, model: str) -> str:
+    # El prompt incluye la orden (con updated_at), items, tags y hallazgos: si algo cambia, cambia la huella
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+async def cached_analysis(order_id: int, fingerprint: str) -> Optional[str]:
+    from .redis_kv import get_json
+    data = await get_json(f"{CACHE_PREFIX}:{order_id}", "preanalyze")
+    if not data:
+        return None
+    return data["analysis"] if data.get("fingerprint") == fingerprint else None
+
+
+async def store_analysis(order_id: int, fingerprint: str, analysis: str, model: str) -> None:
+    from .redis_kv import set_json
+    value = {"fingerprint": fingerprint, "analysis": analysis, "model": model, "ts": time.time()}
+    await set_json(f"{CACHE_PREFIX}:{order_id}", value, ANALYSIS_CACHE_TTL_SEC, "preanalyze")
+
+
+class PreAnalyzer:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, order_id: int) -> bool:
+        """Encola la orden; False si está deshabilitado o el backlog está lleno."""
+        if not PREANALYZE_ENABLED:
+            return False
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=PREANALYZE_MAX_BACKLOG)
+            self._queued.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+        if order_id in self._queued:
+            return True
+        try:
+            self._queue.put_nowait(order_id)
+        except asyncio.QueueFull:
+            print(f"[preanalyze] backlog lleno, se omite la orden {order_id}", file=sys.stderr, flush=True)
+            return False
+        self._queued.add(order_id)
+        return True
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        from .tools import ollama_warm_up
+        try:
+            await ollama_warm_up()
+        except Exception as e:
+            print(f"[preanalyze] warm-up falló: {e}", file=sys.stderr, flush=True)
+        while True:
+            order_id = await self._queue.get()
+            try:
+                await self._wait_idle()
+                self._queued.discard(order_id)
+                await self._analyze(order_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._queued.discard(order_id)
+                print(f"[preanalyze] orden {order_id}: {e}", file=sys.stderr, flush=True)
+
+    async def _wait_idle(self) -> None:
+        # Prioridad baja: sólo usamos Ollama cuando nadie (en ningún worker) lo está usando en vivo
+        from .tools import llm_idle_seconds
+        while True:
+            idle = await llm_idle_seconds()
+            if idle >= PREANALYZE_IDLE_SEC:
+                return
+            await asyncio.sleep(max(PREANALYZE_IDLE_SEC - idle, 0.1))
+
+    async def _analyze(self, order_id: int) -> None:
+        from .db import SessionLocal
+        from .queries import fetch_order_by_id, fetch_order_items, fetch_order_tags
+        from .validate import evaluate_order
+        from .tools import (
+            ANALYZE_MODE, OLLAMA_MODEL, PAID_STATUS_ID, build_analyze_prompt, ollama_generate,
+        )
+        if ANALYZE_MODE == "rules":
+            return
+        # Primario: la orden se acaba de escribir y una réplica podría ir atrasada
+        db = SessionLocal()
+        try:
+            order = fetch_order_by_id(db, order_id)
+            if not order:
+                return
+            items = fetch_order_items(db, order_id)
+            tags = fetch_order_tags(db, order_id)
+        finally:
+            db.close()
+
+        verdict = evaluate_order(order, items, paid_status_id=PAID_STATUS_ID)
+        if ANALYZE_MODE == "auto" and not verdict["anomalous"]:
+            return  # orders.analyze responderá sólo con reglas, no hace falta LLM
+
+        prompt = build_analyze_prompt(order, items, tags, verdict)
+        fingerprint = analysis_fingerprint(prompt, OLLAMA_MODEL)
+        if await cached_analysis(order_id, fingerprint) is not None:
+            return
+        analysis = await ollama_generate(prompt, background=True)
+        await store_analysis(order_id, fingerprint, analysis, OLLAMA_MODEL)
+
+
+preanalyzer = PreAnalyzer()
@@ -0,0 +1,183 @@
+# app/app/profiling.py
+"""
+Profiler opt-in de tools/call (MCP_PROFILE=1).
+
+Por llamada acumula tiempo por tipo de span: db (eventos del engine), redis, llm,
+sink (request al sink más la espera de cupo en el scheduler; lo que el scheduler pasa en
+Redis cuenta como redis) y validate (schemas.py).
+`cpu` es el resto de la llamada (transform, serialización, validación, event loop).
+Si la llamada supera MCP_PROFILE_SLOW_MS se guarda el stack de la tarea en el momento en
+que cruzó el umbral; con MCP_PROFILE_SAMPLE_RATE una fracción de llamadas corre bajo
+cProfile. Las llamadas lentas o muestreadas se persisten en `mcp_call_profiles`.
+"""
+import os, sys, io, time, random, asyncio, cProfile, pstats, json
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+PROFILE_ENABLED = os.getenv("MCP_PROFILE", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("MCP_PROFILE_SLOW_MS", "2000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("MCP_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP = int(os.getenv("MCP_PROFILE_TOP", "30"))   # líneas de pstats guardadas
+
+SPAN_KINDS = ("db", "redis", "llm", "sink", "validate")
+
+_current: ContextVar[Optional["CallProfile"]] = ContextVar("mcp_call_profile", default=None)
+_cprofile_busy = False          # cProfile es global al intérprete: una captura a la vez
+_pending: set = set()           # tareas de persistencia en curso
+
+
+class CallProfile:
+    def __init__(self, tool: str, args: dict):
+        self.tool = tool
+        self.order_id = _as_int(args.get("order_id"))
+        self.session_id = _as_int(args.get("session_id"))
+        self.spans = defaultdict(float)
+        self.stack: Optional[str] = None
+        self.cprofile: Optional[str] = None
+
+    def add(self, kind: str, seconds: float) -> None:
+        self.spans[kind] += seconds
+
+    def breakdown(self, total: float) -> dict:
+        out = {k: round(self.spans.get(k, 0.0) * 1000, 2) for k in SPAN_KINDS}
+        # spans concurrentes (gather a dos sinks) pueden sumar más que el total
+        out["cpu"] = round(max(0.0, total - sum(self.spans.values())) * 1000, 2)
+        out["total"] = round(total * 1000, 2)
+        return out
+
+
+def _as_int(v):
+    try:
+        return int(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def add_span(kind: str, seconds: float) -> None:
+    prof = _current.get()
+    if prof is not None:
+        prof.add(kind, seconds)
+
+
+@contextmanager
+def span(kind: str):
+    """`with span("llm"): await ...` suma el tiempo al perfil de la llamada actual (si hay)."""
+    if _current.get() is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(kind, time.perf_counter() - t0)
+
+
+def instrument_engine(engine) -> None:
+    """Cuenta el tiempo de cada query del engine como span `db`."""
+    if not PROFILE_ENABLED:
+        return
+    from sqlalchemy import event
+
+    # El inicio vive en el ExecutionContext de cada statement: si la query falla no queda
+    # nada colgado en la conexión, y handle_error cuenta igual su tiempo como `db`.
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._mcp_t0 = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        t0 = getattr(context, "_mcp_t0", None)
+        if t0 is not None:
+            add_span("db", time.perf_counter() - t0)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exc_ctx):
+        t0 = getattr(exc_ctx.execution_context, "_mcp_t0", None)
+        if t0 is not None:
+            add_span("db", time.perf_counter() - t0)
+
+
+def _capture_stack(prof: CallProfile, task: asyncio.Task) -> None:
+    if task.done():
+        return
+    buf = io.StringIO()
+    task.print_stack(file=buf)
+    prof.stack = buf.getvalue()
+
+
+async def profile_call(tool: str, args: dict, coro):
+    """Envuelve la ejecución de una tool; sin MCP_PROFILE=1 sólo la espera."""
+    global _cprofile_busy
+    if not PROFILE_ENABLED:
+        return await coro
+
+    prof = CallProfile(tool, args)
+    token = _current.set(prof)
+    loop = asyncio.get_running_loop()
+    watchdog = loop.call_later(PROFILE_SLOW_MS / 1000, _capture_stack, prof, asyncio.current_task())
+
+    profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and not _cprofile_busy and random.random() < PROFILE_SAMPLE_RATE:
+        # Ojo: mientras corre también mide otras corrutinas que se intercalen en el loop
+        _cprofile_busy = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    ok = True
+    t0 = time.perf_counter()
+    try:
+        return await coro
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        total = time.perf_counter() - t0
+        watchdog.cancel()
+        _current.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_busy = False
+            buf = io.StringIO()
+            pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            prof.cprofile = buf.getvalue()
+        slow = total * 1000 >= PROFILE_SLOW_MS
+        if slow or profiler is not None:
+            record = {
+                "tool": tool, "order_id": prof.order_id, "session_id": prof.session_id,
+                "duration_ms": round(total * 1000, 2), "ok": ok,
+                "reason": "slow" if slow else "sampled",
+                "spans": prof.breakdown(total), "stack": prof.stack, "cprofile": prof.cprofile,
+            }
+            # Persistir fuera del camino de la respuesta
+            task = loop.create_task(asyncio.to_thread(_persist, record))
+            _pending.add(task)
+            task.add_done_callback(_pending.discard)
+
+
+async def flush_profiles(timeout: float = 5.0) -> None:
+    """Espera (acotado) a que se guarden los perfiles pendientes; se llama al apagar."""
+    if _pending:
+        await asyncio.wait(list(_pending), timeout=timeout)
+
+
+def _persist(record: dict) -> None:
+    from sqlalchemy import text
+    from .db import SessionLocal
+    db = None
+    try:
+        db = SessionLocal()
+        db.execute(text("""
+            INSERT INTO mcp_call_profiles
+              (tool, order_id, session_id, duration_ms, ok, reason, spans, stack, cprofile)
+            VALUES
+              (:tool, :order_id, :session_id, :duration_ms, :ok, :reason, CAST(:spans AS JSON), :stack, :cprofile)
+        """), {**record, "spans": json.dumps(record["spans"])})
+        db.commit()
+    except Exception as e:
+        print(f"[profiling] no se pudo guardar el perfil de {record['tool']}: {e}", file=sys.stderr, flush=True)
+    finally:
+        if db is not None:
+            db.close()
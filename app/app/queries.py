@@ -51,3 +51,28 @@ def fetch_order_tags(db: Session, order_id: int):
         return [row["tag_name"] for row in db.execute(sql, {"id": order_id}).mappings()]
     except Exception:
         return []
+
+
+def fetch_call_profiles(db: Session, tool: str | None = None, order_id: int | None = None, limit: int = 20):
+    """
+    Perfiles de llamadas lentas/muestreadas (ver profiling.py), más recientes primero.
+    """
+    sql = text("""
+        SELECT id, tool, order_id, session_id, duration_ms, ok, reason, spans, stack, cprofile, created_at
+        FROM mcp_call_profiles
+        WHERE (:tool IS NULL OR tool = :tool)
+          AND (:order_id IS NULL OR order_id = :order_id)
+        ORDER BY created_at DESC, id DESC
+        LIMIT :lim
+    """)
+    return list(db.execute(sql, {"tool": tool, "order_id": order_id, "lim": limit}).mappings())
+
+
+def fetch_recent_order_ids(db: Session, limit: int = 50):
+    sql = text("SELECT id FROM orders ORDER BY updated_at DESC, id DESC LIMIT :lim")
+    return [row["id"] for row in db.execute(sql, {"lim": limit}).mappings()]
+
+
+def fetch_recent_session_ids(db: Session, limit: int = 50):
+    sql = text("SELECT id, title FROM mcp_sessions ORDER BY id DESC LIMIT :lim")
+    return list(db.execute(sql, {"lim": limit}).mappings())
@@ -1,6 +1,78 @@
-import os, redis
-r = redis.from_url(os.environ["REDIS_URL"], decode_responses=True)
+import os, sys, json, redis
+import redis.asyncio as aioredis
+from typing import Optional
+from .profiling import span
+
+# Clientes creados por proceso (después del fork del worker), no al importar.
+_clients: dict = {}
+
+def _client(kind: str):
+    pid = os.getpid()
+    entry = _clients.get(kind)
+    if entry is None or entry[0] != pid:
+        factory = redis.from_url if kind == "sync" else aioredis.from_url
+        entry = _clients[kind] = (pid, factory(os.environ["REDIS_URL"], decode_responses=True))
+    return entry[1]
+
+def get_redis() -> redis.Redis:
+    return _client("sync")
+
+def get_async_redis() -> aioredis.Redis:
+    # Cliente async para los caminos que corren dentro del event loop (scheduler de entregas)
+    return _client("async")
+
+async def close_redis() -> None:
+    for kind, (pid, client) in list(_clients.items()):
+        if pid == os.getpid():
+            if kind == "async":
+                await (client.aclose() if hasattr(client, "aclose") else client.close())
+            else:
+                client.close()
+        _clients.pop(kind, None)
+
+def __getattr__(name):
+    # compat: `from .redis_kv import r, ar`
+    if name == "r":
+        return get_redis()
+    if name == "ar":
+        return get_async_redis()
+    raise AttributeError(name)
 
 def acquire_once(key: str, ttl_sec: int = 3600) -> bool:
     # Idempotencia: SET if Not eXists + expiración
-    return r.set(name=key, value="1", nx=True, ex=ttl_sec) is True
\ No newline at end of file
+    return get_redis().set(name=key, value="1", nx=True, ex=ttl_sec) is True
+
+# ====== Helpers async tolerantes a fallas ======
+# Para estado opcional (caches, contexto, actividad): cuentan como span `redis` y, si Redis
+# no responde, avisan por stderr con el prefijo `tag` y devuelven None en vez de fallar.
+
+async def get_json(key: str, tag: str) -> Optional[dict]:
+    try:
+        with span("redis"):
+            raw = await get_async_redis().get(key)
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"[{tag}] redis get error: {e}", file=sys.stderr, flush=True)
+        return None
+
+async def set_json(key: str, value: dict, ttl: int, tag: str) -> None:
+    try:
+        with span("redis"):
+            await get_async_redis().set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+    except Exception as e:
+        print(f"[{tag}] redis set error: {e}", file=sys.stderr, flush=True)
+
+async def delete_key(key: str, tag: str) -> None:
+    try:
+        with span("redis"):
+            await get_async_redis().delete(key)
+    except Exception as e:
+        print(f"[{tag}] redis delete error: {e}", file=sys.stderr, flush=True)
+
+async def eval_script(script: str, keys: list, *args, tag: str):
+    try:
+        with span("redis"):
+            return await get_async_redis().eval(script, len(keys), *keys, *args)
+    except Exception as e:
+        print(f"[{tag}] redis eval error: {e}", file=sys.stderr, flush=True)
+        return None
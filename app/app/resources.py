@@ -0,0 +1,162 @@
+# app/app/resources.py
+"""
+Resources MCP: order://{id}, order://{id}/payloads y session://{id}.
+
+Cada lectura lleva un `etag`. Si el cliente manda `ifNoneMatch` con el etag vigente se
+responde `notModified` sin armar ni serializar el contenido. Las órdenes usan un hash
+de las filas (orden + items); las sesiones, (cantidad, último id) de sus mensajes.
+Las suscripciones (sólo stdio, que puede empujar notificaciones) se revisan cada
+RESOURCE_POLL_SEC y justo después de cada tools/call que escribió.
+"""
+import os, re, sys, asyncio, hashlib, contextvars
+from typing import Callable, Optional
+from .tools import ToolError, read_db
+
+RESOURCE_POLL_SEC = float(os.getenv("RESOURCE_POLL_SEC", "5"))
+RESOURCE_LIST_LIMIT = int(os.getenv("RESOURCE_LIST_LIMIT", "50"))
+
+_ORDER_URI = re.compile(r"^order://(\d+)(/payloads)?$")
+_SESSION_URI = re.compile(r"^session://(\d+)$")
+
+RESOURCE_TEMPLATES = [
+    {"uriTemplate": "order://{id}", "name": "Orden", "mimeType": "application/json",
+     "description": "Orden con sus items"},
+    {"uriTemplate": "order://{id}/payloads", "name": "Payloads de la orden", "mimeType": "application/json",
+     "description": "Payloads Odoo/Zoho generados a partir de la orden (no enviados)"},
+    {"uriTemplate": "session://{id}", "name": "Sesión MCP", "mimeType": "application/json",
+     "description": "Historial de mensajes de la sesión"},
+]
+
+
+def _rows_etag(*parts) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(repr(p).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _resolve(get_db: Callable, uri: str):
+    """
+    (etag, builder) del resource; builder() arma el contenido sólo si hace falta.
+    La sesión (get_db()) se pide sólo después de validar la URI.
+    """
+    m = _ORDER_URI.match(uri or "")
+    if m:
+        from .queries import fetch_order_by_id, fetch_order_items
+        order_id, payloads = int(m.group(1)), bool(m.group(2))
+        db = get_db()
+        order = fetch_order_by_id(db, order_id)
+        if not order:
+            raise ToolError(404, "resource_not_found")
+        items = fetch_order_items(db, order_id)
+        rows = (tuple(order.values()), [tuple(i.values()) for i in items])
+        if not payloads:
+            return _rows_etag(*rows), lambda: {"order": dict(order), "items": [dict(i) for i in items]}
+        from .transform import build_odoo_invoice, build_zoho_sales_order
+        org_id = os.getenv("ORG_ID_ZOHO", "")
+        return _rows_etag("payloads", org_id, *rows), lambda: {
+            "order_id": order_id,
+            "odoo": build_odoo_invoice(order, items),
+            "zoho": build_zoho_sales_order(order, items, org_id),
+        }
+
+    m = _SESSION_URI.match(uri or "")
+    if m:
+        from .sessions import get_session_version, get_history
+        sid = int(m.group(1))
+        db = get_db()
+        v = get_session_version(db, sid)
+        if v is None:
+            raise ToolError(404, "resource_not_found")
+        return f"{v['n']}-{v['last_id'] or 0}", lambda: {"session_id": sid, "messages": get_history(db, sid, limit=200)}
+
+    raise ToolError(400, f"invalid_uri: {uri}")
+
+
+async def list_resources(params: dict):
+    from .queries import fetch_recent_order_ids, fetch_recent_session_ids
+    db = read_db()
+    resources = []
+    for oid in fetch_recent_order_ids(db, RESOURCE_LIST_LIMIT):
+        resources.append({"uri": f"order://{oid}", "name": f"Orden {oid}", "mimeType": "application/json"})
+        resources.append({"uri": f"order://{oid}/payloads", "name": f"Payloads orden {oid}",
+                          "mimeType": "application/json"})
+    for s in fetch_recent_session_ids(db, RESOURCE_LIST_LIMIT):
+        resources.append({"uri": f"session://{s['id']}", "name": s["title"] or f"Sesión {s['id']}",
+                          "mimeType": "application/json"})
+    return {"resources": resources}
+
+
+async def read_resource(params: dict):
+    from .sessions import json_dumps
+    uri = params.get("uri")
+    etag, build = _resolve(read_db, uri)
+    if params.get("ifNoneMatch") == etag:
+        return {"contents": [], "notModified": True, "etag": etag}
+    return {
+        "contents": [{"uri": uri, "mimeType": "application/json", "text": json_dumps(build())}],
+        "etag": etag,
+    }
+
+
+class Subscriptions:
+    def __init__(self):
+        self._etags: dict[str, Optional[str]] = {}
+        self._notify: Optional[Callable[[dict], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._notify is not None
+
+    def attach(self, notify: Callable[[dict], None]) -> None:
+        """El transporte (stdio) registra cómo empujar notificaciones al cliente."""
+        self._notify = notify
+
+    async def subscribe(self, params: dict):
+        uri = params.get("uri")
+        etag, _ = _resolve(read_db, uri)
+        self._etags[uri] = etag
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._poll(), context=contextvars.Context())
+        return {}
+
+    async def unsubscribe(self, params: dict):
+        self._etags.pop(params.get("uri"), None)
+        return {}
+
+    def poke(self) -> None:
+        """Revisar ya (alguna tool acaba de escribir)."""
+        if self._wake is not None and self._etags:
+            self._wake.set()
+
+    async def _poll(self) -> None:
+        from .db import ReadSessionLocal, SessionLocal
+        while self._etags:
+            poked = True
+            try:
+                await asyncio.wait_for(self._wake.wait(), RESOURCE_POLL_SEC)
+            except asyncio.TimeoutError:
+                poked = False
+            self._wake.clear()
+            # Tras un poke la escritura acaba de ocurrir y una réplica podría no tenerla aún
+            db = SessionLocal() if poked else ReadSessionLocal()
+            try:
+                for uri, old in list(self._etags.items()):
+                    try:
+                        etag, _ = _resolve(lambda: db, uri)
+                    except ToolError:
+                        etag = None  # borrado: también es un cambio
+                    if etag != old and uri in self._etags:
+                        self._etags[uri] = etag
+                        self._notify({"jsonrpc": "2.0", "method": "notifications/resources/updated",
+                                      "params": {"uri": uri}})
+            except Exception as e:
+                print(f"[resources] poll error: {e}", file=sys.stderr, flush=True)
+            finally:
+                db.close()
+
+
+subscriptions = Subscriptions()
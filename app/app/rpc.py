@@ -0,0 +1,87 @@
+# app/app/rpc.py
+"""Despacho JSON-RPC de MCP compartido por el transporte HTTP (mcp_server) y stdio."""
+import sys
+from .tools import TOOLS, TOOL_HANDLERS, ToolError, run_tool
+from .profiling import profile_call
+from .schemas import InvalidParams, validate_tool_args
+from .resources import RESOURCE_TEMPLATES, list_resources, read_resource, subscriptions
+
+PROTOCOL_VERSION = "2024-09"
+SERVER_NAME = "mcp-orchestrator"
+SERVER_VERSION = "0.1.0"
+
+# ====== JSON-RPC helpers ======
+def make_result(_id, result):
+    return {"jsonrpc": "2.0", "id": _id, "result": result}
+
+def make_error(_id, code, message, data=None):
+    err = {"jsonrpc": "2.0", "id": _id, "error": {"code": code, "message": message}}
+    if data is not None:
+        err["error"]["data"] = data
+    return err
+
+async def _validated_call(name: str, handler, args):
+    return await run_tool(handler, validate_tool_args(name, args))
+
+async def handle_jsonrpc(body: dict):
+    if body is None or body.get("_parse_error"):
+        return make_error(None, -32700, (body or {}).get("_parse_error", "Parse error"))
+
+    if body.get("jsonrpc") != "2.0" or "method" not in body:
+        return make_error(body.get("id"), -32600, "Invalid Request")
+
+    method = body["method"]
+    params = body.get("params") or {}
+    _id = body.get("id")
+
+    try:
+        if method == "initialize":
+            return make_result(_id, {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {
+                    "tools": True,
+                    "resources": {"subscribe": subscriptions.enabled, "listChanged": False},
+                    "prompts": False
+                },
+                "serverInfo": {"name": SERVER_NAME, "version": SERVER_VERSION}
+            })
+
+        if method == "tools/list":
+            return make_result(_id, {"tools": TOOLS})
+
+        if method == "tools/call":
+            name = params.get("name")
+            args = params.get("arguments") or {}
+            handler = TOOL_HANDLERS.get(name)
+            if handler is None:
+                return make_error(_id, -32601, f"Method not found: {name}")
+            try:
+                # la validación corre dentro del perfil: cuenta en el span `validate`
+                return make_result(_id, await profile_call(name, args, _validated_call(name, handler, args)))
+            except InvalidParams as ip:
+                return make_error(_id, -32602, "Invalid params", {"errors": ip.errors})
+
+        if method == "resources/templates/list":
+            return make_result(_id, {"resourceTemplates": RESOURCE_TEMPLATES})
+
+        if method == "resources/list":
+            return make_result(_id, await run_tool(list_resources, params))
+
+        if method == "resources/read":
+            return make_result(_id, await run_tool(read_resource, params))
+
+        if method in ("resources/subscribe", "resources/unsubscribe"):
+            if not subscriptions.enabled:
+                return make_error(_id, -32601, f"{method} requiere el transporte stdio")
+            handler = subscriptions.subscribe if method == "resources/subscribe" else subscriptions.unsubscribe
+            return make_result(_id, await run_tool(handler, params))
+
+        return make_error(_id, -32601, f"Unknown method: {method}")
+
+    except ToolError as te:
+        # Mapea errores HTTP a JSON-RPC estándar
+        return make_error(_id, -32000, "Internal MCP error", {"status": te.status_code, "detail": te.detail})
+    except Exception as e:
+        # Log a stderr para depurar
+        print(f"[mcp] Exception: {e}", file=sys.stderr, flush=True)
+        return make_error(_id, -32000, "Internal MCP error", {"detail": str(e)})
@@ -0,0 +1,234 @@
+# app/app/scheduler.py
+"""
+Scheduler de entregas hacia los sinks (Odoo/Zoho).
+
+- Token bucket por sink/org (ORG_ID_ZOHO, ORG_ID_ODOO) compartido entre procesos vía Redis.
+- Máximo de requests en vuelo por destino, también en Redis: cada slot es un lease
+  con expiración en un ZSET, así un worker que muere no deja slots tomados.
+- Cola justa entre órdenes: round-robin por order_id, una orden con muchos envíos
+  no acapara el destino.
+
+Uso:
+    async with delivery.slot("zoho", order_id):
+        res = await client.post(SINK_ZOHO_URL, json=payload)
+"""
+import os, sys, time, asyncio, uuid, contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+from .profiling import add_span, span
+
+KEY_PREFIX = os.getenv("SINK_LIMIT_PREFIX", "mcp:sink")
+LEASE_SEC = float(os.getenv("SINK_LEASE_SEC", "60"))        # > timeout del cliente HTTP
+POLL_SEC = float(os.getenv("SINK_POLL_SEC", "0.05"))         # re-intento cuando el destino está lleno
+
+# Token bucket: devuelve 0 si tomó un token, o los ms a esperar.
+# Usa TIME de Redis para que todos los workers compartan el mismo reloj.
+_TOKEN_BUCKET_LUA = """
+local cooldown = redis.call('PTTL', KEYS[2])
+if cooldown > 0 then return cooldown end
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1])
+local ts = tonumber(data[2])
+if tokens == nil then
+  tokens = burst
+  ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+# Lease de concurrencia: limpia leases vencidos y agrega uno si hay cupo.
+_LEASE_LUA = """
+local limit = tonumber(ARGV[1])
+local lease_ms = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < limit then
+  redis.call('ZADD', KEYS[1], now + lease_ms, ARGV[3])
+  redis.call('PEXPIRE', KEYS[1], lease_ms)
+  return 1
+end
+return 0
+"""
+
+
+def _sink_config(sink: str) -> dict:
+    name = sink.upper()
+    return {
+        "org": os.getenv(f"ORG_ID_{name}", ""),
+        "rate": float(os.getenv(f"SINK_{name}_RATE", "5")),            # requests/seg por org
+        "burst": float(os.getenv(f"SINK_{name}_BURST", "10")),
+        "max_inflight": int(os.getenv(f"SINK_{name}_MAX_INFLIGHT", "4")),
+    }
+
+
+def _redis():
+    # import diferido: el cliente sólo se necesita cuando realmente se entrega algo
+    from .redis_kv import get_async_redis
+    return get_async_redis()
+
+
+class _Lane:
+    """Cola de un destino (sink + org). Un único dispatcher por proceso la drena."""
+
+    def __init__(self, sink: str, cfg: dict):
+        self.sink = sink
+        self.rate = max(cfg["rate"], 0.001)
+        self.burst = max(cfg["burst"], 1.0)
+        self.max_inflight = max(cfg["max_inflight"], 1)
+        base = f"{KEY_PREFIX}:{sink}:{cfg['org'] or '-'}"
+        self.bucket_key = f"{base}:bucket"
+        self.cooldown_key = f"{base}:cooldown"
+        self.inflight_key = f"{base}:inflight"
+        self.waiting: "OrderedDict[str, deque[asyncio.Future]]" = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._redis_s = 0.0     # tiempo en Redis del dispatcher para el slot que está consiguiendo
+
+    # ---- cola justa ----
+    def enqueue(self, order_key: str, fut: asyncio.Future) -> None:
+        self.waiting.setdefault(order_key, deque()).append(fut)
+        if self._task is None or self._task.done():
+            # contexto vacío: el dispatcher sirve a muchas llamadas, no hereda la del primero
+            self._task = asyncio.get_running_loop().create_task(self._dispatch(), context=contextvars.Context())
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        # round-robin: toma el primero de la orden más antigua y la manda al final
+        while self.waiting:
+            order_key, q = next(iter(self.waiting.items()))
+            fut = q.popleft()
+            if q:
+                self.waiting.move_to_end(order_key)
+            else:
+                del self.waiting[order_key]
+            if not fut.done():
+                return fut
+        return None
+
+    def _has_waiters(self) -> bool:
+        return any(not f.done() for q in self.waiting.values() for f in q)
+
+    # ---- límites compartidos (Redis) ----
+    async def _try_lease(self, member: str) -> bool:
+        t0 = time.perf_counter()
+        try:
+            ok = await _redis().eval(_LEASE_LUA, 1, self.inflight_key,
+                                     self.max_inflight, int(LEASE_SEC * 1000), member)
+            return bool(ok)
+        except Exception as e:
+            # Redis caído: dejamos pasar (fail-open) para no frenar las entregas
+            print(f"[scheduler] lease error ({self.sink}): {e}", file=sys.stderr, flush=True)
+            return True
+        finally:
+            self._redis_s += time.perf_counter() - t0
+
+    async def _take_token(self) -> int:
+        t0 = time.perf_counter()
+        try:
+            return int(await _redis().eval(_TOKEN_BUCKET_LUA, 2, self.bucket_key, self.cooldown_key,
+                                           self.rate, self.burst))
+        except Exception as e:
+            print(f"[scheduler] token error ({self.sink}): {e}", file=sys.stderr, flush=True)
+            return 0
+        finally:
+            self._redis_s += time.perf_counter() - t0
+
+    async def release(self, member: str) -> None:
+        try:
+            with span("redis"):
+                await _redis().zrem(self.inflight_key, member)
+        except Exception as e:
+            print(f"[scheduler] release error ({self.sink}): {e}", file=sys.stderr, flush=True)
+        self._wake.set()
+
+    async def penalize(self, seconds: float) -> None:
+        # 429 del sink: todos los workers pausan este destino hasta que pase el Retry-After
+        try:
+            with span("redis"):
+                await _redis().set(self.cooldown_key, "1", px=max(int(seconds * 1000), 1))
+        except Exception as e:
+            print(f"[scheduler] penalize error ({self.sink}): {e}", file=sys.stderr, flush=True)
+
+    async def _dispatch(self) -> None:
+        while self._has_waiters():
+            self._redis_s = 0.0
+            # Primero el token (y el cooldown de un 429), después el lease: si el lease se
+            # tomara antes, un Retry-After > SINK_LEASE_SEC lo dejaría vencer mientras dormimos.
+            wait_ms = await self._take_token()
+            while wait_ms > 0:
+                await asyncio.sleep(wait_ms / 1000)
+                wait_ms = await self._take_token()
+            member = uuid.uuid4().hex
+            while not await self._try_lease(member):
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+            fut = self._next_waiter()
+            if fut is None:
+                await self.release(member)
+                continue
+            # el dispatcher corre fuera del perfil de la llamada: su tiempo en Redis viaja con el slot
+            fut.set_result((member, self._redis_s))
+
+
+class DeliveryScheduler:
+    def __init__(self):
+        self._lanes: dict[str, _Lane] = {}
+
+    def _lane(self, sink: str) -> _Lane:
+        lane = self._lanes.get(sink)
+        if lane is None:
+            lane = self._lanes[sink] = _Lane(sink, _sink_config(sink))
+        return lane
+
+    @asynccontextmanager
+    async def slot(self, sink: str, order_id):
+        """
+        Espera turno (cola justa + rate limit + cupo en vuelo) para enviar a `sink`.
+        En el perfil de la llamada, el tiempo del dispatcher en Redis cuenta como `redis` y el
+        resto de la espera (cola, rate limit, cooldown) como `sink`.
+        """
+        lane = self._lane(sink)
+        fut = asyncio.get_running_loop().create_future()
+        lane.enqueue(str(order_id), fut)
+        t0 = time.perf_counter()
+        try:
+            member, redis_s = await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                await lane.release(fut.result()[0])
+            raise
+        waited = time.perf_counter() - t0
+        redis_s = min(redis_s, waited)
+        add_span("redis", redis_s)
+        add_span("sink", waited - redis_s)
+        try:
+            yield
+        finally:
+            await lane.release(member)
+
+    async def penalize(self, sink: str, retry_after: Optional[str]) -> None:
+        try:
+            seconds = float(retry_after) if retry_after else 1.0
+        except ValueError:
+            seconds = 1.0
+        await self._lane(sink).penalize(seconds)
+
+
+delivery = DeliveryScheduler()
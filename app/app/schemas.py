@@ -0,0 +1,93 @@
+# app/app/schemas.py
+"""
+Validadores precompilados (pydantic v2 TypeAdapter).
+
+- Argumentos de cada tool, generados desde su `inputSchema` en TOOLS.
+- Payloads salientes contra OdooInvoice / ZohoSalesOrder, antes de enviarlos al sink.
+
+Se compilan una sola vez: al arrancar el servidor HTTP (main.lifespan) o en la primera
+tools/call por stdio, para que `initialize`/`tools/list` no paguen el import de pydantic.
+El costo de cada validación se acumula en validation_stats() y como span `validate`.
+"""
+import time
+from collections import defaultdict
+from typing import Any, Literal, Optional
+from .profiling import add_span
+
+_JSON_TYPES = {"integer": int, "number": float, "string": str, "boolean": bool, "object": dict, "array": list}
+
+_tool_adapters: Optional[dict] = None
+_payload_adapters: Optional[dict] = None
+_stats = defaultdict(lambda: {"calls": 0, "rejected": 0, "total_us": 0.0, "max_us": 0.0})
+
+
+class InvalidParams(Exception):
+    def __init__(self, errors: list):
+        super().__init__("Invalid params")
+        self.errors = errors
+
+
+def _model_for(tool_name: str, schema: dict):
+    from pydantic import ConfigDict, create_model
+    required = set(schema.get("required", []))
+    fields = {}
+    for prop, spec in (schema.get("properties") or {}).items():
+        typ = Literal[tuple(spec["enum"])] if "enum" in spec else _JSON_TYPES.get(spec.get("type"), Any)
+        fields[prop] = (typ, ...) if prop in required else (Optional[typ], None)
+    name = "Args_" + "".join(c if c.isalnum() else "_" for c in tool_name)
+    # extra="allow": argumentos no declarados siguen pasando como antes
+    return create_model(name, __config__=ConfigDict(extra="allow"), **fields)
+
+
+def compile_validators() -> None:
+    global _tool_adapters, _payload_adapters
+    if _tool_adapters is not None:
+        return
+    from pydantic import TypeAdapter
+    from .models import OdooInvoice, ZohoSalesOrder
+    from .tools import TOOLS
+    _tool_adapters = {t["name"]: TypeAdapter(_model_for(t["name"], t.get("inputSchema") or {})) for t in TOOLS}
+    _payload_adapters = {"odoo": TypeAdapter(OdooInvoice), "zoho": TypeAdapter(ZohoSalesOrder)}
+
+
+def _run(key: str, adapter, data):
+    from pydantic import ValidationError
+    t0 = time.perf_counter()
+    st = _stats[key]
+    st["calls"] += 1
+    try:
+        return adapter.validate_python(data)
+    except ValidationError as e:
+        st["rejected"] += 1
+        raise InvalidParams(e.errors(include_url=False, include_context=False)) from None
+    finally:
+        elapsed = time.perf_counter() - t0
+        us = elapsed * 1e6
+        st["total_us"] += us
+        st["max_us"] = max(st["max_us"], us)
+        add_span("validate", elapsed)
+
+
+def validate_tool_args(tool_name: str, args: dict) -> dict:
+    """Valida y normaliza (ej. "5" -> 5) los argumentos; lanza InvalidParams si no cumplen el schema."""
+    compile_validators()
+    adapter = _tool_adapters.get(tool_name)
+    if adapter is None:
+        return args
+    if not isinstance(args, dict):
+        raise InvalidParams([{"type": "dict_type", "loc": [], "msg": "arguments debe ser un objeto"}])
+    return _run(f"tool:{tool_name}", adapter, args).model_dump(exclude_unset=True)
+
+
+def validate_payload(sink: str, payload: dict) -> None:
+    """Verifica el payload contra el modelo del sink antes de enviarlo."""
+    compile_validators()
+    _run(f"payload:{sink}", _payload_adapters[sink], payload)
+
+
+def validation_stats() -> dict:
+    return {
+        key: {**st, "avg_us": round(st["total_us"] / st["calls"], 2) if st["calls"] else 0.0,
+              "total_us": round(st["total_us"], 2), "max_us": round(st["max_us"], 2)}
+        for key, st in _stats.items()
+    }
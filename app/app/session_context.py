@@ -0,0 +1,153 @@
+# app/app/session_context.py
+"""
+Contexto de sesión para orders.analyze (use_session_context=true).
+
+El prompt lleva una ventana acotada: los últimos SESSION_CONTEXT_WINDOW mensajes, más
+un resumen acumulado (en Redis) de los que fueron saliendo de la ventana. El resumen
+es extractivo (una línea por mensaje) y se recorta a SESSION_SUMMARY_MAX_CHARS.
+
+Además se guarda el `context` que devuelve Ollama por (sesión, orden, modelo). Si la
+orden no cambió, el siguiente turno envía sólo lo nuevo (mensajes posteriores + la
+pregunta) junto con esos tokens, en lugar de re-enviar toda la orden. Ese `context` es
+la conversación completa y crece en cada turno: al pasar SESSION_LLM_CONTEXT_MAX_TOKENS
+se descarta y el turno vuelve al prompt acotado (ventana + resumen), antes de que Ollama
+lo recorte por el principio (donde está la orden) al llenar su num_ctx.
+"""
+import os, json
+from typing import Optional
+
+SESSION_CONTEXT_WINDOW = int(os.getenv("SESSION_CONTEXT_WINDOW", "6"))
+SESSION_CONTEXT_MAX_CHARS = int(os.getenv("SESSION_CONTEXT_MAX_CHARS", "3000"))
+SESSION_SUMMARY_MAX_CHARS = int(os.getenv("SESSION_SUMMARY_MAX_CHARS", "1500"))
+SESSION_SUMMARY_TTL_SEC = int(os.getenv("SESSION_SUMMARY_TTL_SEC", "604800"))
+SESSION_LLM_CONTEXT_TTL_SEC = int(os.getenv("SESSION_LLM_CONTEXT_TTL_SEC", "3600"))
+# Debe quedar por debajo del num_ctx del modelo (2048 por defecto en Ollama), con margen para el turno
+SESSION_LLM_CONTEXT_MAX_TOKENS = int(os.getenv("SESSION_LLM_CONTEXT_MAX_TOKENS", "1536"))
+# Tope de mensajes nuevos que se buscan para un turno incremental; si hay más, se rearma el prompt
+_NEW_MESSAGES_LIMIT = 200
+KEY_PREFIX = "mcp:session"
+
+
+def _clip(s: str, n: int) -> str:
+    return s if len(s) <= n else s[: n - 1] + "…"
+
+
+def message_line(msg: dict) -> str:
+    """Una línea por mensaje: rol, tool, orden, pregunta y resultado (sin prompts ni payloads)."""
+    c = msg.get("content")
+    if isinstance(c, (str, bytes)):
+        c = json.loads(c)
+    c = c or {}
+    parts = [msg["role"]]
+    if c.get("tool"):
+        parts.append(c["tool"])
+    args = c.get("args") or {}
+    if args.get("order_id") is not None:
+        parts.append(f"orden {args['order_id']}")
+    if args.get("prompt"):
+        parts.append(f"pregunta: {_clip(args['prompt'], 200)}")
+    detail = c.get("result_text")
+    if detail is None and isinstance(c.get("result"), dict):
+        res = c["result"]
+        detail = res.get("error") or ("ok" if res.get("ok") else None)
+    if detail:
+        parts.append(_clip(" ".join(str(detail).split()), 240))
+    return " | ".join(parts)
+
+
+async def _get_json(key: str) -> Optional[dict]:
+    from .redis_kv import get_json
+    return await get_json(key, "session_context")
+
+
+async def _set_json(key: str, value: dict, ttl: int) -> None:
+    from .redis_kv import set_json
+    await set_json(key, value, ttl, "session_context")
+
+
+async def _delete(key: str) -> None:
+    from .redis_kv import delete_key
+    await delete_key(key, "session_context")
+
+
+async def _rolling_summary(db, session_id: int, window_start_id: int) -> str:
+    """Resumen de los mensajes anteriores a la ventana; sólo procesa los que salieron desde la última vez."""
+    from .sessions import get_messages_between
+    key = f"{KEY_PREFIX}:{session_id}:summary"
+    state = await _get_json(key) or {"upto_id": 0, "text": ""}
+    if window_start_id - 1 > state["upto_id"]:
+        evicted = get_messages_between(db, session_id, state["upto_id"], window_start_id)
+        if evicted:
+            text = state["text"] + "".join(f"\n- {message_line(m)}" for m in evicted)
+            if len(text) > SESSION_SUMMARY_MAX_CHARS:
+                text = "…" + text[-(SESSION_SUMMARY_MAX_CHARS - 1):]   # se conserva lo más reciente
+            state = {"upto_id": evicted[-1]["id"], "text": text.strip()}
+            await _set_json(key, state, SESSION_SUMMARY_TTL_SEC)
+    return state["text"]
+
+
+def _llm_context_key(session_id: int, order_id: int, model: str) -> str:
+    return f"{KEY_PREFIX}:{session_id}:llmctx:{order_id}:{model}"
+
+
+async def prepare(db, session_id: int, order_id: int, model: str, full_prompt: str,
+                  order_fp: str, question: str) -> tuple[str, Optional[list], dict]:
+    """
+    Arma el prompt con contexto de sesión. Devuelve (prompt, context de Ollama o None, estado);
+    el estado se pasa luego a remember().
+    """
+    from .sessions import get_recent_messages, get_messages_between
+    recent = get_recent_messages(db, session_id, SESSION_CONTEXT_WINDOW)
+    state = {"session_id": session_id, "order_id": order_id, "model": model, "order_fp": order_fp,
+             "incremental": False, "messages": len(recent)}
+
+    key = _llm_context_key(session_id, order_id, model)
+    cached = await _get_json(key)
+    if cached and cached.get("order_fp") == order_fp and cached.get("context"):
+        last_id = cached.get("last_msg_id", 0)
+        new_msgs = [m for m in recent if m["id"] > last_id]
+        complete = True
+        if recent and recent[0]["id"] > last_id + 1:
+            # Llegaron más mensajes que la ventana desde el último turno: traer también los del medio
+            gap = get_messages_between(db, session_id, last_id, recent[0]["id"], limit=_NEW_MESSAGES_LIMIT)
+            complete = len(gap) < _NEW_MESSAGES_LIMIT
+            new_msgs = gap + new_msgs
+        if complete and len(cached["context"]) <= SESSION_LLM_CONTEXT_MAX_TOKENS:
+            # Misma orden, mismo modelo: Ollama ya tiene el contexto; mandamos sólo lo nuevo
+            news = "".join(f"\n- {message_line(m)}" for m in new_msgs)
+            if len(news) > SESSION_CONTEXT_MAX_CHARS:
+                news = "\n…" + news[-(SESSION_CONTEXT_MAX_CHARS - 2):]
+            prompt = (f"Novedades en la sesión:{news}\n\n" if news else "") + \
+                     f"Seguimiento sobre la misma orden {order_id} (sin cambios): {question}\n"
+            state.update(incremental=True, messages=len(new_msgs))
+            return prompt, cached["context"], state
+        # Contexto demasiado largo (o demasiadas novedades): se descarta y se rearma acotado
+        await _delete(key)
+
+    summary = await _rolling_summary(db, session_id, recent[0]["id"]) if recent else ""
+    block = ""
+    if summary:
+        block += f"Resumen de la sesión:\n{summary}\n"
+    if recent:
+        block += "Mensajes recientes:" + "".join(f"\n- {message_line(m)}" for m in recent) + "\n"
+    if not block:
+        return full_prompt, None, state
+    if len(block) > SESSION_CONTEXT_MAX_CHARS:
+        block = "…" + block[-(SESSION_CONTEXT_MAX_CHARS - 1):]
+    return f"Contexto de la sesión {session_id}:\n{block}\n{full_prompt}", None, state
+
+
+async def remember(db, state: dict, context: Optional[list]) -> None:
+    """Guarda el `context` devuelto por Ollama para el próximo turno (tras registrar los mensajes del turno)."""
+    from .sessions import get_session_version
+    key = _llm_context_key(state["session_id"], state["order_id"], state["model"])
+    if not context or len(context) > SESSION_LLM_CONTEXT_MAX_TOKENS:
+        # Sin context o ya sobre el tope: el próximo turno arma el prompt acotado desde cero
+        await _delete(key)
+        return
+    v = get_session_version(db, state["session_id"]) or {}
+    await _set_json(
+        key,
+        {"order_fp": state["order_fp"], "context": context, "last_msg_id": v.get("last_id") or 0},
+        SESSION_LLM_CONTEXT_TTL_SEC,
+    )
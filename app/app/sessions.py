@@ -30,6 +30,42 @@ def get_history(db: Session, session_id: int, limit: int = 50) -> List[Dict[str,
     rows = db.execute(sql, {"sid": session_id, "lim": limit}).mappings().all()
     return [{"role": r["role"], "content": r["content"], "created_at": r["created_at"].isoformat()} for r in rows]
 
+def get_recent_messages(db: Session, session_id: int, limit: int = 6) -> List[Dict[str, Any]]:
+    """Últimos `limit` mensajes (con id), en orden cronológico."""
+    sql = text("""
+        SELECT id, role, content
+        FROM mcp_messages
+        WHERE session_id = :sid
+        ORDER BY id DESC
+        LIMIT :lim
+    """)
+    rows = db.execute(sql, {"sid": session_id, "lim": limit}).mappings().all()
+    return [dict(r) for r in reversed(rows)]
+
+def get_messages_between(db: Session, session_id: int, after_id: int, before_id: int,
+                         limit: int = 200) -> List[Dict[str, Any]]:
+    sql = text("""
+        SELECT id, role, content
+        FROM mcp_messages
+        WHERE session_id = :sid AND id > :after AND id < :before
+        ORDER BY id ASC
+        LIMIT :lim
+    """)
+    rows = db.execute(sql, {"sid": session_id, "after": after_id, "before": before_id, "lim": limit}).mappings().all()
+    return [dict(r) for r in rows]
+
+def get_session_version(db: Session, session_id: int) -> Optional[Dict[str, Any]]:
+    # Los mensajes sólo se insertan o se borran: (cantidad, último id) cambia con cada escritura
+    sql = text("""
+        SELECT s.id,
+               (SELECT COUNT(*) FROM mcp_messages m WHERE m.session_id = s.id) AS n,
+               (SELECT MAX(m.id) FROM mcp_messages m WHERE m.session_id = s.id) AS last_id
+        FROM mcp_sessions s
+        WHERE s.id = :sid
+    """)
+    row = db.execute(sql, {"sid": session_id}).mappings().first()
+    return dict(row) if row else None
+
 def clear_session(db: Session, session_id: int) -> None:
     db.execute(text("DELETE FROM mcp_messages WHERE session_id = :sid"), {"sid": session_id})
     db.commit()
@@ -1,12 +1,9 @@
 # app/stdio_server.py
 import sys, json, asyncio, re
-from fastapi import HTTPException
 
-from app.mcp_server import (
-    PROTOCOL_VERSION, SERVER_NAME, SERVER_VERSION,
-    TOOLS, make_result, make_error,
-    _call_analyze, _call_transform, _call_send_mock, _call_order_paid
-)
+# Sólo stdlib + rpc/tools: DB, Redis y HTTP se inicializan en la primera tools/call
+from app.rpc import make_error, handle_jsonrpc
+from app.resources import subscriptions
 
 # ---- Helpers de framing ----
 HEADER_RE = re.compile(rb"^Content-Length:\s*(\d+)\r?\n$", re.IGNORECASE)
@@ -56,50 +53,6 @@ def write_ndjson(obj: dict):
     sys.stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
     sys.stdout.flush()
 
-async def handle_jsonrpc(body: dict):
-    if body is None or body.get("_parse_error"):
-        return make_error(None, -32700, body.get("_parse_error", "Parse error"))
-
-    if body.get("jsonrpc") != "2.0" or "method" not in body:
-        return make_error(body.get("id"), -32600, "Invalid Request")
-
-    method = body["method"]
-    params = body.get("params") or {}
-    _id = body.get("id")
-
-    try:
-        if method == "initialize":
-            return make_result(_id, {
-                "protocolVersion": PROTOCOL_VERSION,
-                "capabilities": {"tools": True, "resources": False, "prompts": False},
-                "serverInfo": {"name": SERVER_NAME, "version": SERVER_VERSION}
-            })
-
-        if method == "tools/list":
-            return make_result(_id, {"tools": TOOLS})
-
-        if method == "tools/call":
-            name = params.get("name")
-            args = params.get("arguments") or {}
-            if name == "orders.analyze":
-                return make_result(_id, await _call_analyze(args))
-            if name == "orders.transform":
-                return make_result(_id, await _call_transform(args))
-            if name == "orders.send_mock":
-                return make_result(_id, await _call_send_mock(args))
-            if name == "webhooks.order_paid":
-                return make_result(_id, await _call_order_paid(args))
-            return make_error(_id, -32601, f"Method not found: {name}")
-
-        return make_error(_id, -32601, f"Unknown method: {method}")
-
-    except HTTPException as he:
-        return make_error(_id, -32000, "Internal MCP error", {"status": he.status_code, "detail": he.detail})
-    except Exception as e:
-        # Log a stderr para depurar
-        print(f"[stdio_server] Exception: {e}", file=sys.stderr, flush=True)
-        return make_error(_id, -32000, "Internal MCP error", {"detail": str(e)})
-
 async def main():
   
     loop = asyncio.get_event_loop()
@@ -118,6 +71,8 @@ async def main():
 
     # ¿Framed?
     is_framed = bool(HEADER_RE.match(first_line.strip()))
+    # Notificaciones de resources suscritos, con el mismo framing que las respuestas
+    subscriptions.attach(write_framed_message if is_framed else write_ndjson)
     if is_framed:
         # Procesa este header y el resto como framed
         pending_header = first_line
@@ -0,0 +1,593 @@
+# app/app/tools.py
+"""
+Implementación de las tools MCP, independiente del transporte (HTTP o stdio).
+
+No importa FastAPI, y SQLAlchemy/Redis/httpx se importan dentro de cada tool:
+`initialize` y `tools/list` no pagan ese costo, el engine y los clientes se crean
+en el primer uso.
+"""
+import os, json, time, uuid, asyncio
+from contextvars import ContextVar
+from typing import Optional
+from .validate import (
+    validate_items_present, validate_basic_totals, validate_customer, ValidationError,
+    evaluate_order, verdict_text,
+)
+from .transform import build_odoo_invoice, build_zoho_sales_order
+from .scheduler import delivery
+from .profiling import span
+from .preanalyze import (
+    PREANALYZE_ENABLED, preanalyzer, analysis_fingerprint, cached_analysis, store_analysis,
+)
+
+# ====== CONFIG ======
+# Relee las mismas vars de entorno que usas en main.py
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "127.0.0.1")
+OLLAMA_PORT = os.getenv("OLLAMA_PORT", "11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")   # mantiene el modelo cargado entre llamadas
+OLLAMA_TIMEOUT_SEC = 120                                    # también vence el registro de llamada en vivo
+WEBHOOK_SECRET = os.getenv("MCP_WEBHOOK_SECRET", "changeme")
+PAID_STATUS_ID = int(os.getenv("PAID_STATUS_ID", "2"))
+SINK_ODOO_URL = os.getenv("SINK_ODOO_URL", "http://127.0.0.1:8080/mock/odoo/invoices")
+SINK_ZOHO_URL = os.getenv("SINK_ZOHO_URL", "http://127.0.0.1:8080/mock/zoho/salesorders")
+
+BASE_ANALYZE_PROMPT = os.getenv(
+    "ANALYZE_PROMPT",
+    (
+        "Eres un asistente MCP de integraciones. Analiza la orden y responde en español, "
+        "breve y claro: (1) si los totales parecen coherentes con las líneas, "
+        "(2) campos críticos que faltan para Odoo/Zoho (NIT, dirección, SKU, qty>0), "
+        "(3) alertas de riesgo (voided, estado de pago/envío), (4) sugerencia de acción."
+    ),
+)
+
+# orders.analyze: "rules" = sólo reglas, "llm" = siempre LLM,
+# "auto" = reglas y LLM sólo si la orden es anómala o viene un prompt explícito
+ANALYZE_MODES = ("auto", "rules", "llm")
+ANALYZE_MODE = os.getenv("ANALYZE_MODE", "auto")
+
+
+class ToolError(Exception):
+    """Error de una tool con status estilo HTTP; el transporte lo mapea a JSON-RPC."""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+TOOLS = [
+    {
+        "name": "orders.analyze",
+        "description": "Analiza una orden con reglas y, si hace falta, con LLM",
+        "inputSchema": {
+            "type": "object",
+            "required": ["order_id"],
+            "properties": {
+                "order_id": {"type": "integer"},
+                "prompt": {"type": "string"},
+                "model": {"type": "string"},
+                "mode": {"type": "string", "enum": ["auto", "rules", "llm"]},
+                "use_session_context": {"type": "boolean"},
+                "session_id": {"type": "integer"}  
+            }
+        }
+    },
+    {
+        "name": "orders.transform",
+        "description": "Convierte la orden a payloads Odoo/Zoho (no los envía)",
+        "inputSchema": {
+            "type": "object",
+            "required": ["order_id"],
+            "properties": {
+                "order_id": {"type": "integer"},
+                "session_id": {"type": "integer"}  
+
+            }
+        }
+    },
+    {
+        "name": "orders.send_mock",
+        "description": "Genera y envía payloads a los endpoints mock (Odoo/Zoho)",
+        "inputSchema": {
+            "type": "object",
+            "required": ["order_id"],
+            "properties": {"order_id": {"type": "integer"},            
+                            "session_id": {"type": "integer"} 
+            }
+        }
+    },
+    {
+        "name": "webhooks.order_paid",
+        "description": "Marca como pagada, valida y prepara payloads",
+        "inputSchema": {
+            "type": "object",
+            "required": ["order_id", "secret"],
+            "properties": {
+                "order_id": {"type": "integer"},
+                "secret":   {"type": "string"},
+                "source":   {"type": "string"},
+                "session_id": {"type": "integer"} 
+            }
+        }
+    },
+    {
+        "name": "sessions.create",
+        "description": "Crea una nueva sesión y devuelve session_id",
+        "inputSchema": {
+            "type": "object",
+            "properties": { "title": {"type":"string"} }
+        }
+    },
+    {
+        "name": "sessions.get_history",
+        "description": "Devuelve el historial de una sesión",
+        "inputSchema": {
+            "type": "object",
+            "required": ["session_id"],
+            "properties": { "session_id": {"type":"integer"} }
+        }
+    },
+    {
+        "name": "diagnostics.slow_calls",
+        "description": "Perfiles de llamadas lentas o muestreadas (MCP_PROFILE=1), filtrables por tool y orden",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "tool": {"type": "string"},
+                "order_id": {"type": "integer"},
+                "limit": {"type": "integer"}
+            }
+        }
+    },
+]
+
+# ====== Ollama helper ======
+# Actividad de llamadas en vivo (las de background no cuentan): el pre-análisis sólo corre
+# cuando el modelo lleva un rato sin uso. Todos los workers comparten el mismo Ollama, así
+# que la actividad se registra en Redis: un ZSET de llamadas en vivo (con vencimiento, como
+# los leases del scheduler, para que un worker caído no lo deje "ocupado") y la hora de la
+# última que terminó. El contador local cubre el caso de Redis caído, y es lo único que se
+# lleva con PREANALYZE_ENABLED=0 (nadie consulta la actividad compartida).
+LLM_LIVE_KEY = "mcp:llm:live"
+LLM_LAST_DONE_KEY = "mcp:llm:last_done"
+_llm_live = {"inflight": 0, "last_done": float("-inf")}
+
+_LLM_BEGIN_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[1]), ARGV[2])
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[1]))
+return 1
+"""
+
+_LLM_END_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('SET', KEYS[2], now)
+return 1
+"""
+
+# ms desde la última llamada en vivo terminada (0 si hay alguna en curso, -1 si nunca hubo)
+_LLM_IDLE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) > 0 then return 0 end
+local last = tonumber(redis.call('GET', KEYS[2]))
+if last == nil then return -1 end
+return math.max(now - last, 0)
+"""
+
+async def _llm_live_eval(script: str, keys: list, *args):
+    from .redis_kv import eval_script
+    return await eval_script(script, keys, *args, tag="llm")
+
+async def llm_idle_seconds() -> float:
+    """Segundos sin llamadas en vivo a Ollama, en cualquier worker."""
+    if _llm_live["inflight"] > 0:
+        return 0.0
+    local = time.monotonic() - _llm_live["last_done"]
+    shared = await _llm_live_eval(_LLM_IDLE_LUA, [LLM_LIVE_KEY, LLM_LAST_DONE_KEY])
+    if shared is None or int(shared) < 0:
+        return local
+    return min(local, int(shared) / 1000)
+
+async def ollama_generate(prompt: str, model: str | None = None, background: bool = False) -> str:
+    data = await ollama_generate_ex(prompt, model=model, background=background)
+    return data.get("response", "")
+
+async def ollama_generate_ex(prompt: str, model: str | None = None, background: bool = False,
+                             context: list | None = None) -> dict:
+    """Respuesta completa de /api/generate (incluye `context` para continuar la conversación)."""
+    from .http_clients import get_http_client
+    mdl = model or OLLAMA_MODEL
+    url = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/generate"
+    payload = {"model": mdl, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE}
+    if context:
+        payload["context"] = context
+    call_id = None
+    if not background:
+        _llm_live["inflight"] += 1
+    try:
+        if not background and PREANALYZE_ENABLED:
+            call_id = uuid.uuid4().hex
+            await _llm_live_eval(_LLM_BEGIN_LUA, [LLM_LIVE_KEY], OLLAMA_TIMEOUT_SEC * 1000, call_id)
+        with span("llm"):
+            r = await get_http_client().post(url, json=payload, timeout=OLLAMA_TIMEOUT_SEC)
+    finally:
+        if not background:
+            _llm_live["inflight"] -= 1
+            _llm_live["last_done"] = time.monotonic()
+            if call_id is not None:
+                await _llm_live_eval(_LLM_END_LUA, [LLM_LIVE_KEY, LLM_LAST_DONE_KEY], call_id)
+    r.raise_for_status()
+    return r.json()
+
+async def ollama_warm_up(model: str | None = None) -> None:
+    """Carga el modelo en memoria (generate sin prompt) para evitar el stall de recarga."""
+    from .http_clients import get_http_client
+    url = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/generate"
+    payload = {"model": model or OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}
+    r = await get_http_client().post(url, json=payload, timeout=OLLAMA_TIMEOUT_SEC)
+    r.raise_for_status()
+
+
+# ====== Sesiones de DB por llamada ======
+# Cada tools/call tiene su propio estado (ver run_tool): una sesión al primario y una de
+# lectura. Apenas la llamada pide el primario para escribir, sus lecturas siguientes
+# también van al primario (read-your-writes).
+_call_db: ContextVar[Optional[dict]] = ContextVar("mcp_call_db", default=None)
+
+def _db():
+    """Sesión al primario (escrituras o lecturas que deben ver lo último)."""
+    st = _call_db.get()
+    if st is None:
+        from .db import get_session
+        # get_session() es un generator (yield); aquí obtenemos una sesión usable
+        return next(get_session())
+    st["pinned"] = True
+    if st["primary"] is None:
+        from .db import SessionLocal
+        st["primary"] = SessionLocal()
+    return st["primary"]
+
+def read_db():
+    """Sesión de sólo lectura: réplica si está configurada y la llamada aún no escribió."""
+    st = _call_db.get()
+    if st is None or st["pinned"]:
+        return _db()
+    if st["replica"] is None:
+        from .db import ReadSessionLocal
+        st["replica"] = ReadSessionLocal()
+    return st["replica"]
+
+def build_analyze_prompt(order, items, tags, verdict: dict, override: str = "") -> str:
+    head = override if override else BASE_ANALYZE_PROMPT.strip()
+
+    totals = verdict["totals"]
+    findings = "\n".join(f"- [{i['severity']}] {i['message']}" for i in verdict["issues"]) or "- ninguno"
+
+    return (
+        f"{head}\n\n"
+        f"ORDER: {dict(order)}\n"
+        f"ITEMS: {[dict(x) for x in items]}\n"
+        f"TAGS: {tags}\n"
+        f"\nResumen numérico:\n"
+        f"- Total líneas (qty*precio + impuesto): {totals['lines']}\n"
+        f"- Total orden: {totals['order']}\n"
+        f"- Diferencia: {totals['difference']}\n"
+        f"\nHallazgos de las reglas automáticas:\n{findings}\n"
+        f"Explica si cuadran o no y sugiere la siguiente acción.\n"
+    )
+
+async def _call_analyze(args: dict):
+    from .queries import fetch_order_by_id, fetch_order_items, fetch_order_tags
+    from .sessions import append_message
+    order_id = args["order_id"]
+    override = (args.get("prompt") or "").strip()
+    model = args.get("model")
+    session_id = args.get("session_id") 
+    mode = (args.get("mode") or ANALYZE_MODE).strip().lower()
+    if mode not in ANALYZE_MODES:
+        raise ToolError(400, f"invalid_mode: {mode}")
+    use_session_context = bool(args.get("use_session_context")) and bool(session_id)
+
+    rdb = read_db()
+    order = fetch_order_by_id(rdb, order_id)
+    if not order:
+        raise ToolError(404, "order_not_found")
+    items = fetch_order_items(rdb, order_id)
+    tags  = fetch_order_tags(rdb, order_id)
+    rdb.close()  # libera la conexión mientras esperamos al LLM
+
+    # Tier 1: reglas (microsegundos). Tier 2: LLM sólo si hace falta.
+    verdict = evaluate_order(order, items, paid_status_id=PAID_STATUS_ID)
+    # calc sale del veredicto: misma base (qty*price + tax) y tolerancia que las reglas
+    totals = verdict["totals"]
+    subtotal_total, total_order, diff = totals["lines"], totals["order"], totals["difference"]
+    use_llm = mode == "llm" or (mode == "auto" and (verdict["anomalous"] or bool(override)))
+
+    prompt = build_analyze_prompt(order, items, tags, verdict, override) if use_llm else None
+
+    # Contexto de sesión acotado (ventana + resumen) y reuso del `context` de Ollama
+    llm_context, ctx_state = None, None
+    if use_llm and use_session_context:
+        from . import session_context
+        mdl = model or OLLAMA_MODEL
+        order_fp = analysis_fingerprint(build_analyze_prompt(order, items, tags, verdict), mdl)
+        prompt, llm_context, ctx_state = await session_context.prepare(
+            _db(), session_id, order_id, mdl, prompt, order_fp, override or BASE_ANALYZE_PROMPT.strip()
+        )
+
+    if session_id:
+        append_message(_db(), session_id, "user", {
+            "tool": "orders.analyze",
+            "args": {"order_id": order_id, "prompt": override, "model": model, "mode": mode},
+            "computed": {"subtotal_items": subtotal_total, "total_order": total_order, "diff": diff},
+            "prompt_to_llm": prompt
+        })
+
+    cached = False
+    new_context = None
+    if use_llm:
+        # Sólo el prompt por defecto (sin contexto de sesión) se cachea: es lo que precalcula el
+        # pre-análisis; sin PREANALYZE_ENABLED no hay nada que leer ni guardar en Redis
+        cacheable = PREANALYZE_ENABLED and not override and ctx_state is None
+        fingerprint = analysis_fingerprint(prompt, model or OLLAMA_MODEL) if cacheable else None
+        analysis = await cached_analysis(order_id, fingerprint) if fingerprint else None
+        cached = analysis is not None
+        if not cached:
+            data = await ollama_generate_ex(prompt, model=model, context=llm_context)
+            analysis = data.get("response", "")
+            new_context = data.get("context")
+            if fingerprint:
+                await store_analysis(order_id, fingerprint, analysis, model or OLLAMA_MODEL)
+    else:
+        analysis = verdict_text(verdict)
+
+    if session_id:
+        append_message(_db(), session_id, "assistant", {
+            "tool": "orders.analyze",
+            "result_text": analysis,
+            "llm_used": use_llm
+        })
+    if ctx_state is not None:
+        await session_context.remember(_db(), ctx_state, new_context)
+
+    return {
+        "ok": True,
+        "order_id": order_id,
+        "calc": {
+            "subtotal_items": subtotal_total,
+            "total_order": total_order,
+            "difference": diff,
+            "matches": totals["matches"]
+        },
+        "analysis": analysis,
+        "verdict": verdict,
+        "mode": mode,
+        "llm_used": use_llm,
+        "cached": cached,
+        "session_context": (
+            {"incremental": ctx_state["incremental"], "messages": ctx_state["messages"]} if ctx_state else None
+        ),
+        "session_id": session_id
+    }
+
+
+async def _call_transform(args: dict):
+    from .queries import fetch_order_by_id, fetch_order_items
+    from .sessions import append_message
+    order_id = args["order_id"]
+    session_id = args.get("session_id")  
+
+    rdb = read_db()
+    order = fetch_order_by_id(rdb, order_id)
+    if not order:
+        raise ToolError(404, "order_not_found")
+    items = fetch_order_items(rdb, order_id)
+
+    validate_items_present(items)
+    validate_customer(order)
+    validate_basic_totals(order, items)
+
+    odoo_payload = build_odoo_invoice(order, items)
+    zoho_payload = build_zoho_sales_order(order, items, os.getenv("ORG_ID_ZOHO",""))
+
+    if session_id:
+        append_message(_db(), session_id, "tool", {
+            "tool": "orders.transform",
+            "args": {"order_id": order_id},
+            "output": {"odoo": odoo_payload, "zoho": zoho_payload}
+        })
+
+    return {"ok": True, "order_id": order_id, "odoo": odoo_payload, "zoho": zoho_payload, "session_id": session_id}
+
+async def _call_send_mock(args: dict):
+    from .queries import fetch_order_by_id, fetch_order_items
+    from .sessions import append_message
+    from .http_clients import get_http_client
+    from .schemas import InvalidParams, validate_payload
+    order_id = args["order_id"]
+    session_id = args.get("session_id") 
+
+    db = _db()
+    order = fetch_order_by_id(db, order_id)
+    if not order:
+        raise ToolError(404, "order_not_found")
+    items = fetch_order_items(db, order_id)
+
+    validate_items_present(items)
+    validate_customer(order)
+    validate_basic_totals(order, items)
+
+    odoo_payload = build_odoo_invoice(order, items)
+    zoho_payload = build_zoho_sales_order(order, items, os.getenv("ORG_ID_ZOHO",""))
+
+    # Rechazo local de payloads mal formados, antes del round trip al sink
+    for sink, payload in (("odoo", odoo_payload), ("zoho", zoho_payload)):
+        try:
+            validate_payload(sink, payload)
+        except InvalidParams as ip:
+            raise ToolError(422, {"error": "invalid_payload", "sink": sink, "errors": ip.errors})
+
+    async def _deliver(c, sink: str, url: str, payload: dict):
+        # rate limit por sink/org + cupo en vuelo, compartidos entre workers (ver scheduler.py)
+        async with delivery.slot(sink, order_id):
+            with span("sink"):
+                res = await c.post(url, json=payload)
+        if res.status_code == 429:
+            await delivery.penalize(sink, res.headers.get("Retry-After"))
+        res.raise_for_status()
+        return res.json()
+
+    c = get_http_client()
+    odoo_data, zoho_data = await asyncio.gather(
+        _deliver(c, "odoo", SINK_ODOO_URL, odoo_payload),
+        _deliver(c, "zoho", SINK_ZOHO_URL, zoho_payload),
+        return_exceptions=True,
+    )
+    for res in (odoo_data, zoho_data):
+        if isinstance(res, BaseException):
+            raise res
+
+    if session_id:
+        append_message(db, session_id, "tool", {
+            "tool": "orders.send_mock",
+            "args": {"order_id": order_id},
+            "payloads": {"odoo": odoo_payload, "zoho": zoho_payload},
+            "results": {"odoo_result": odoo_data, "zoho_result": zoho_data}
+        })
+
+    return {
+        "ok": True, "order_id": order_id,
+        "odoo_result": odoo_data, "zoho_result": zoho_data,
+        "session_id": session_id
+    }
+
+async def _call_order_paid(args: dict):
+    from sqlalchemy import text
+    from .queries import fetch_order_by_id, fetch_order_items
+    from .sessions import append_message
+    secret = args.get("secret")
+    if secret != WEBHOOK_SECRET:
+        raise ToolError(401, "unauthorized")
+
+    order_id = args["order_id"]
+    source = args.get("source", "mcp-tool")
+    session_id = args.get("session_id")  # <-- nuevo
+
+    db = _db()
+    order = fetch_order_by_id(db, order_id)
+    if not order:
+        raise ToolError(404, "order_not_found")
+
+    # log user: intención de marcar pagado
+    if session_id:
+        append_message(db, session_id, "user", {
+            "tool": "webhooks.order_paid",
+            "args": {"order_id": order_id, "source": source}
+        })
+
+    db.execute(
+        text("UPDATE orders SET status_payment_id = :paid WHERE id = :id"),
+        {"paid": PAID_STATUS_ID, "id": order_id}
+    )
+    db.commit()
+    # Pre-análisis especulativo en background (si PREANALYZE_ENABLED=1)
+    preanalyzer.submit(order_id)
+
+    order = fetch_order_by_id(db, order_id)
+    items = fetch_order_items(db, order_id)
+
+    try:
+        validate_items_present(items)
+        validate_customer(order)
+        validate_basic_totals(order, items)
+    except ValidationError as ve:
+        if session_id:
+            append_message(db, session_id, "assistant", {
+                "tool": "webhooks.order_paid",
+                "result": {"ok": False, "error": str(ve)}
+            })
+        return {"ok": False, "error": str(ve), "order": dict(order), "items": [dict(i) for i in items], "session_id": session_id}
+
+    odoo_payload = build_odoo_invoice(order, items)
+    zoho_payload = build_zoho_sales_order(order, items, os.getenv("ORG_ID_ZOHO",""))
+    result = {
+        "ok": True,
+        "status_payment_id": order.get("status_payment_id"),
+        "odoo_invoice": odoo_payload,
+        "zoho_sales_order": zoho_payload
+    }
+
+    # log assistant: resultado
+    if session_id:
+        append_message(db, session_id, "assistant", {
+            "tool": "webhooks.order_paid",
+            "result": result
+        })
+
+    return {**result, "session_id": session_id}
+
+
+
+async def _call_sessions_create(args: dict):
+    from .sessions import create_session
+    title = (args.get("title") or "").strip()
+    db = _db()
+    sid = create_session(db, title or None)
+    return {"ok": True, "session_id": sid, "title": title or None}
+
+async def _call_sessions_get_history(args: dict):
+    from .sessions import get_history
+    sid = args["session_id"]
+    hist = get_history(read_db(), sid, limit=200)
+    return {"ok": True, "session_id": sid, "messages": hist}
+
+async def _call_diagnostics_slow_calls(args: dict):
+    from .queries import fetch_call_profiles
+    tool = args.get("tool") or None
+    order_id = args.get("order_id")
+    limit = max(1, min(args.get("limit") or 20, 200))
+    rows = fetch_call_profiles(read_db(), tool=tool, order_id=order_id, limit=limit)
+    calls = []
+    for r in rows:
+        spans = r["spans"]
+        calls.append({
+            **dict(r),
+            "duration_ms": float(r["duration_ms"]),
+            "ok": bool(r["ok"]),
+            "spans": json.loads(spans) if isinstance(spans, str) else spans,
+            "created_at": r["created_at"].isoformat(),
+        })
+    return {"ok": True, "calls": calls}
+
+async def run_tool(handler, args: dict):
+    """Ejecuta una tool con su propio estado de DB y cierra las sesiones al terminar."""
+    st = {"primary": None, "replica": None, "pinned": False}
+    token = _call_db.set(st)
+    try:
+        return await handler(args)
+    finally:
+        _call_db.reset(token)
+        for sess in (st["primary"], st["replica"]):
+            if sess is not None:
+                sess.close()
+        if st["pinned"]:
+            # la llamada pudo escribir: revisar ya los resources suscritos
+            from .resources import subscriptions
+            subscriptions.poke()
+
+TOOL_HANDLERS = {
+    "orders.analyze": _call_analyze,
+    "orders.transform": _call_transform,
+    "orders.send_mock": _call_send_mock,
+    "webhooks.order_paid": _call_order_paid,
+    "sessions.create": _call_sessions_create,
+    "sessions.get_history": _call_sessions_get_history,
+    "diagnostics.slow_calls": _call_diagnostics_slow_calls,
+}
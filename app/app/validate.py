@@ -3,17 +3,21 @@ from typing import Mapping, Sequence
 
 class ValidationError(Exception): ...
 
+TOTALS_TOLERANCE = 0.05
+
+def lines_total(items: Sequence[Mapping]) -> float:
+    """Total de las líneas: qty*price + impuesto. Base única para todo chequeo de totales."""
+    total = 0.0
+    for it in items:
+        total += int(it.get("qty", 0)) * float(it.get("price", 0)) + float(it.get("tax_amount", 0) or 0)
+    return total
+
 def validate_items_present(items: Sequence[Mapping]):
     if not items:
         raise ValidationError("La orden no tiene items.")
 
-def validate_basic_totals(order: Mapping, items: Sequence[Mapping], tolerance: float = 0.05):
-    total_items = 0.0
-    for it in items:
-        qty = int(it.get("qty", 0))
-        price = float(it.get("price", 0))
-        tax = float(it.get("tax_amount", 0) or 0)
-        total_items += qty * price + tax
+def validate_basic_totals(order: Mapping, items: Sequence[Mapping], tolerance: float = TOTALS_TOLERANCE):
+    total_items = lines_total(items)
     doc_total = float(order.get("total") or 0)
     if abs(total_items - doc_total) > tolerance:
         raise ValidationError(f"Total no cuadra: líneas={total_items:.2f} vs orden={doc_total:.2f}")
@@ -21,3 +25,78 @@ def validate_basic_totals(order: Mapping, items: Sequence[Mapping], tolerance: f
 def validate_customer(order: Mapping):
     if not (order.get("name_shipping") and order.get("address_shipping")):
         raise ValidationError("Faltan datos del cliente/dirección.")
+
+
+# ====== Veredicto determinístico (sin LLM) ======
+# Mismas preguntas que BASE_ANALYZE_PROMPT, resueltas con reglas. No lanza excepciones:
+# devuelve todos los hallazgos. Severidades: error/warning marcan la orden como anómala, info no.
+
+def evaluate_order(order: Mapping, items: Sequence[Mapping], paid_status_id: int | None = None,
+                   tolerance: float = TOTALS_TOLERANCE) -> dict:
+    issues = []
+
+    def add(code: str, severity: str, message: str):
+        issues.append({"code": code, "severity": severity, "message": message})
+
+    # (1) totales
+    total_items = lines_total(items)
+    doc_total = float(order.get("total") or 0)
+    diff = round(doc_total - total_items, 2)
+    if not items:
+        add("no_items", "error", "La orden no tiene items.")
+    elif abs(diff) > tolerance:
+        add("totals_mismatch", "error", f"Total no cuadra: líneas={total_items:.2f} vs orden={doc_total:.2f}")
+
+    # (2) campos críticos para Odoo/Zoho
+    if not order.get("name_shipping"):
+        add("missing_customer", "error", "Falta el nombre del cliente.")
+    if not order.get("address_shipping"):
+        add("missing_address", "error", "Falta la dirección de envío.")
+    if not (order.get("NIT") or "").strip():
+        add("missing_nit", "warning", "Falta el NIT (usar 'CF' si es consumidor final).")
+    for idx, it in enumerate(items, start=1):
+        label = it.get("name") or it.get("sku") or f"línea {idx}"
+        if not it.get("sku"):
+            add("missing_sku", "warning", f"Item sin SKU: {label}.")
+        if int(it.get("qty", 0)) <= 0:
+            add("bad_qty", "error", f"Cantidad inválida (qty={it.get('qty')}) en {label}.")
+
+    # (3) alertas de riesgo
+    if order.get("voided"):
+        add("voided", "error", "La orden está anulada (voided).")
+    if paid_status_id is not None and order.get("status_payment_id") != paid_status_id:
+        add("not_paid", "info", f"Pago no confirmado (status_payment_id={order.get('status_payment_id')}).")
+    if order.get("status_shipping_id") is None:
+        add("no_shipping_status", "info", "Sin estado de envío.")
+
+    anomalous = any(i["severity"] in ("error", "warning") for i in issues)
+    return {
+        "anomalous": anomalous,
+        "issues": issues,
+        "totals": {"lines": round(total_items, 2), "order": doc_total, "difference": diff,
+                   "matches": bool(items) and abs(diff) <= tolerance},
+    }
+
+def verdict_text(verdict: dict) -> str:
+    """Resumen en español del veredicto, con la misma estructura que pide el prompt de análisis."""
+    by_sev = {"error": [], "warning": [], "info": []}
+    for i in verdict["issues"]:
+        by_sev[i["severity"]].append(i["message"])
+    t = verdict["totals"]
+    codes = {i["code"] for i in verdict["issues"]}
+    lines = []
+    if "totals_mismatch" in codes or "no_items" in codes:
+        lines.append(f"(1) Totales: no cuadran (líneas={t['lines']:.2f}, orden={t['order']:.2f}).")
+    else:
+        lines.append(f"(1) Totales: coherentes ({t['order']:.2f}).")
+    missing = [i["message"] for i in verdict["issues"] if i["code"].startswith("missing_") or i["code"] == "bad_qty"]
+    lines.append("(2) Campos críticos: " + (" ".join(missing) if missing else "completos para Odoo/Zoho."))
+    risks = [i["message"] for i in verdict["issues"] if i["code"] in ("voided", "not_paid", "no_shipping_status")]
+    lines.append("(3) Alertas: " + (" ".join(risks) if risks else "ninguna."))
+    if by_sev["error"]:
+        lines.append("(4) Acción: corregir los errores antes de enviar a Odoo/Zoho.")
+    elif by_sev["warning"]:
+        lines.append("(4) Acción: completar los datos faltantes; la orden puede enviarse.")
+    else:
+        lines.append("(4) Acción: lista para enviar a Odoo/Zoho.")
+    return "\n".join(lines)
@@ -0,0 +1,89 @@
+# app/scripts/bench_stdio.py
+"""
+Benchmark de arranque del servidor stdio.
+
+Lanza `python -X importtime -m app.stdio_server` varias veces, mide el tiempo
+hasta la respuesta de `initialize` y de `tools/list`, e imprime el perfil de
+imports (módulos con mayor tiempo acumulado) de la última corrida.
+
+Uso (desde app/):
+    python scripts/bench_stdio.py --runs 10 --target-ms 150
+
+Sale con código 1 si la mediana de `tools/list` supera el objetivo.
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUESTS = [
+    {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}},
+    {"jsonrpc": "2.0", "id": 2, "method": "tools/list", "params": {}},
+]
+
+
+def run_once():
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-m", "app.stdio_server"],
+        cwd=APP_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    marks = {}
+    for req in REQUESTS:
+        proc.stdin.write((json.dumps(req) + "\n").encode())
+        proc.stdin.flush()
+        line = proc.stdout.readline()
+        resp = json.loads(line)
+        if "error" in resp:
+            raise RuntimeError(f"{req['method']} falló: {resp['error']}")
+        marks[req["method"]] = (time.perf_counter() - t0) * 1000
+    proc.stdin.close()
+    err = proc.stderr.read()
+    proc.wait(timeout=10)
+    return marks, err.decode(errors="replace")
+
+
+def import_profile(stderr: str, top: int):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time:  <self us> | <cumulative us> | <module>"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--target-ms", type=float, default=150.0)
+    ap.add_argument("--top", type=int, default=15)
+    opts = ap.parse_args()
+
+    results = {"initialize": [], "tools/list": []}
+    stderr = ""
+    for _ in range(opts.runs):
+        marks, stderr = run_once()
+        for k, v in marks.items():
+            results[k].append(v)
+
+    print(f"stdio startup ({opts.runs} corridas, ms desde spawn)")
+    for method, vals in results.items():
+        vals.sort()
+        p95 = vals[min(len(vals) - 1, int(round(0.95 * (len(vals) - 1))))]
+        print(f"  {method:<12} median={statistics.median(vals):7.1f}  p95={p95:7.1f}  max={vals[-1]:7.1f}")
+
+    print(f"\nimport-time profile (top {opts.top} por acumulado, última corrida)")
+    print(f"  {'cumul ms':>9} {'self ms':>8}  module")
+    for cumulative_us, self_us, name in import_profile(stderr, opts.top):
+        print(f"  {cumulative_us / 1000:9.1f} {self_us / 1000:8.1f}  {name}")
+
+    median = statistics.median(results["tools/list"])
+    ok = median <= opts.target_ms
+    print(f"\ntools/list median {median:.1f} ms vs objetivo {opts.target_ms:.0f} ms: {'OK' if ok else 'FAIL'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS mcp_call_profiles (
+  id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  tool VARCHAR(64) NOT NULL,
+  order_id BIGINT NULL,
+  session_id BIGINT NULL,
+  duration_ms DECIMAL(12,2) NOT NULL,
+  ok TINYINT(1) NOT NULL DEFAULT 1,
+  reason VARCHAR(16) NOT NULL,      -- 'slow','sampled'
+  spans JSON NOT NULL,              -- ms por db/redis/llm/sink/cpu + total
+  stack TEXT NULL,                  -- stack de la tarea al cruzar el umbral
+  cprofile MEDIUMTEXT NULL,         -- pstats (top por acumulado) si fue muestreada
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_mcp_call_profiles_tool_time ON mcp_call_profiles(tool, created_at);
+CREATE INDEX idx_mcp_call_profiles_order_time ON mcp_call_profiles(order_id, created_at);